@@ -6,13 +6,18 @@ image_date_organizer.cli
 :license: BSD-3-clause
 """
 import pathlib
-from typing import Any
+from typing import Any, Optional
 
 import click
 from loguru import logger
 
-from .organize import DEFAULT_IMAGE_EXTRACTORS, DEFAULT_VIDEO_EXTRACTORS, Organizer
-from .utils import get_package_version
+from .organize import (
+    DEFAULT_IMAGE_EXTRACTORS,
+    DEFAULT_MAX_WORKERS,
+    DEFAULT_VIDEO_EXTRACTORS,
+    Organizer,
+)
+from .utils import DEFAULT_CACHE_PATH, MetadataCache, get_package_version
 
 
 def path_callback(
@@ -39,6 +44,34 @@ def path_callback(
     default=False,
 )
 @click.option("--dry-run / --no-dry-run", help="Perform a dry run.", default=False)
+@click.option(
+    "--verify / --no-verify",
+    help="Enable to verify checksums of copied files against their source. "
+    "Copies are always verified with --remove-source.",
+    default=False,
+)
+@click.option(
+    "--cache / --no-cache",
+    help=f"Enable to cache extracted dates in {DEFAULT_CACHE_PATH}.",
+    default=False,
+)
+@click.option(
+    "--hardlink / --no-hardlink",
+    help="Enable to hardlink rather than copy files when source and destination "
+    "are on the same filesystem.",
+    default=False,
+)
+@click.option(
+    "--parallel / --no-parallel",
+    help="Organize files concurrently.",
+    default=True,
+)
+@click.option(
+    "-j",
+    "--workers",
+    type=click.IntRange(min=1),
+    help=f"Number of files to organize concurrently. [default: {DEFAULT_MAX_WORKERS}]",
+)
 @click.option(
     "-l",
     "--log-level",
@@ -50,6 +83,11 @@ def main(
     dest: pathlib.Path,
     remove_source: bool,
     dry_run: bool,
+    verify: bool,
+    cache: bool,
+    hardlink: bool,
+    parallel: bool,
+    workers: Optional[int],
     log_level: str = "INFO",
 ):
     """
@@ -69,10 +107,20 @@ def main(
     """
     logger.level(log_level)
     logger.info(f"Organizing {source} into destination {dest}")
+    metadata_cache = MetadataCache() if cache else None
     organizer = Organizer(
         image_extractors=DEFAULT_IMAGE_EXTRACTORS,
         video_extractors=DEFAULT_VIDEO_EXTRACTORS,
         remove_source=remove_source,
         dry_run=dry_run,
+        verify=verify,
+        cache=metadata_cache,
+        parallel=parallel,
+        max_workers=workers,
+        hardlink=hardlink,
     )
-    organizer.organize(source, dest)
+    try:
+        organizer.organize(source, dest)
+    finally:
+        if metadata_cache is not None:
+            metadata_cache.close()
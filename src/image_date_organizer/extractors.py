@@ -7,17 +7,26 @@ image_date_organizer.extractors
 """
 import abc
 import datetime
+import functools
+import io
+import json
+import os
 import pathlib
 import re
+import struct
 import subprocess
-from typing import Optional, cast
+import threading
+from typing import Dict, Mapping, Optional, Sequence
 
 import pendulum
 from loguru import logger
 from PIL import Image
-from PIL.ExifTags import TAGS
 
-EXIF_DATE_FIELD = next(k for k, v in TAGS.items() if v == "DateTime")
+EXIF_DATE_FIELD = 0x0132  # tag id of DateTime
+
+# File signatures and metadata such as EXIF are almost always found within the
+# first 64 KiB of a file, so that is all we read up front.
+HEADER_SIZE = 64 * 1024
 
 
 class Extractor(abc.ABC):
@@ -36,41 +45,217 @@ class Extractor(abc.ABC):
 
         Must be implemented in subclasses.
 
+        Subclasses may additionally accept either of these optional keyword
+        arguments, which the organizer then passes on when it has them:
+
+        - header: Leading bytes of the file, if the caller already read them.
+          Extractors may use this to avoid opening the file again.
+        - stat: Stat result of the file, if the caller already has it.
+
         :param path: Concrete path to the image or video.
         :return: Date when we can extract the date, None otherwise
         """
         ...
 
+    def prefetch(self, paths: Sequence[pathlib.Path]) -> None:
+        """Prepare for extracting the dates of many files.
+
+        Extractors that can more efficiently extract dates in bulk may do so here,
+        ahead of calls to `extract` for the same paths. Does nothing by default.
+
+        :param paths: Paths of images or videos that will be extracted.
+        """
+
+    def close(self) -> None:
+        """Release any resources held by the extractor. Does nothing by default."""
+
 
 class ExifImageExtractor(Extractor):
     """
     Extract the date using the EXIF date tag.
     """
 
-    def extract(self, path: pathlib.Path) -> Optional[datetime.date]:
-        image = Image.open(path)
+    def extract(
+        self,
+        path: pathlib.Path,
+        header: Optional[bytes] = None,
+        stat: Optional[os.stat_result] = None,
+    ) -> Optional[datetime.date]:
+        if header is None:
+            with path.open("rb") as handle:
+                header = handle.read(HEADER_SIZE)
+        exif = _find_jpeg_exif(header)
+        if exif is not None:
+            date_field = _read_exif_date_time(exif) if exif else None
+        elif _may_have_exif(header):
+            # Not a JPEG, or its EXIF segment is not within the header.
+            date_field = self._read_date_time(path, header)
+        else:
+            return None
+
         date: Optional[datetime.date] = None
-        if "exif" in image.info:
-            exif_data = image._getexif()
-            if EXIF_DATE_FIELD in exif_data:
-                date = cast(
-                    pendulum.DateTime, pendulum.parse(exif_data[EXIF_DATE_FIELD])
-                ).date()
+        if date_field is not None:
+            try:
+                date = _date_from_exif(date_field)
+            except ValueError:
+                logger.warning(
+                    f"Could not determine exif-provided date for {path}. "
+                    f"{date_field} is not a valid date-time."
+                )
         return date
 
+    @classmethod
+    def _read_date_time(
+        cls, path: pathlib.Path, header: Optional[bytes]
+    ) -> Optional[str]:
+        """Read the raw DateTime tag of an image with Pillow."""
+        image = cls._open(path, header)
+        if "exif" in image.info:
+            return _read_exif_date_time(image.info["exif"])
+        if hasattr(image, "tag_v2"):
+            # TIFF based images are EXIF structured themselves. Only do this for
+            # these, as getexif has to decode other images without an EXIF segment.
+            value = image.getexif().get(EXIF_DATE_FIELD)
+            return value if isinstance(value, str) else None
+        return None
+
+    @staticmethod
+    def _open(path: pathlib.Path, header: Optional[bytes]) -> Image.Image:
+        """Open image from its header when possible, from the full file otherwise.
+
+        The EXIF segment is almost always located near the start of the file, so
+        the header tends to suffice.
+        """
+        if header is not None:
+            try:
+                return Image.open(io.BytesIO(header))
+            except OSError:
+                logger.debug(f"Header of {path} is not enough to open it.")
+        return Image.open(path)
+
+
+def _find_jpeg_exif(data: bytes) -> Optional[bytes]:
+    """Find the EXIF data of a JPEG by walking the segments at its start.
+
+    EXIF data is stored in an APP1 segment, which precedes the image data. Only the
+    segment headers are read to find it, so no decoder has to be initialized.
+
+    :param data: Leading bytes of a file.
+    :return: Contents of the EXIF segment, including its 'Exif\0\0' marker. Empty
+        bytes when the JPEG has no EXIF segment. None when data is not a JPEG, or
+        does not contain the complete EXIF segment.
+    """
+    if not data.startswith(b"\xff\xd8"):
+        return None
+    offset = 2
+    while offset + 4 <= len(data):
+        if data[offset] != 0xFF:
+            return None  # corrupt
+        marker = data[offset + 1]
+        if marker == 0xFF:  # fill byte
+            offset += 1
+            continue
+        if marker in (0xD9, 0xDA):  # end of image, start of scan
+            return b""
+        if marker == 0x01 or 0xD0 <= marker <= 0xD7:  # markers without a length
+            offset += 2
+            continue
+        (length,) = struct.unpack_from(">H", data, offset + 2)
+        end = offset + 2 + length
+        if marker == 0xE1 and data.startswith(b"Exif\0\0", offset + 4):
+            return data[offset + 4 : end] if end <= len(data) else None
+        offset = end
+    return None
+
+
+def _may_have_exif(header: bytes) -> bool:
+    """Whether a file may have EXIF data, judging by its leading bytes.
+
+    Opening a file with Pillow is only worthwhile for formats that can carry EXIF,
+    such as JPEG, PNG, TIFF, WebP and HEIF.
+    """
+    if header.startswith(b"\x89PNG\r\n\x1a\n"):
+        # EXIF is only read from chunks that precede the image data.
+        image_data = header.find(b"IDAT")
+        return image_data == -1 or b"eXIf" in header[:image_data]
+    if header[:4] == b"RIFF":
+        return header[8:12] == b"WEBP"
+    return header.startswith((b"\xff\xd8\xff", b"II*\0", b"MM\0*")) or (
+        header[4:8] == b"ftyp"
+    )
+
+
+def _read_exif_date_time(exif: bytes) -> Optional[str]:
+    """Read the raw DateTime tag from EXIF data.
+
+    EXIF data is TIFF structured. Rather than decoding all tags of all IFDs, we only
+    walk the entries of IFD0, where DateTime lives, and decode just that tag.
+
+    :param exif: EXIF data, optionally prefixed with the 'Exif\\0\\0' marker of the
+        JPEG APP1 segment.
+    :return: DateTime tag value, None if there is no valid DateTime tag.
+    """
+    if exif.startswith(b"Exif\0\0"):
+        exif = exif[6:]
+    if exif[:2] == b"II":
+        byte_order = "<"
+    elif exif[:2] == b"MM":
+        byte_order = ">"
+    else:
+        return None
+
+    try:
+        (ifd_offset,) = struct.unpack_from(byte_order + "L", exif, 4)
+        (num_entries,) = struct.unpack_from(byte_order + "H", exif, ifd_offset)
+        for i in range(num_entries):
+            entry_offset = ifd_offset + 2 + 12 * i
+            tag, field_type, count, value_offset = struct.unpack_from(
+                byte_order + "HHLL", exif, entry_offset
+            )
+            if tag != EXIF_DATE_FIELD:
+                continue
+            if field_type != 2:  # ASCII
+                return None
+            # Values of at most four bytes are stored in the entry itself.
+            start = entry_offset + 8 if count <= 4 else value_offset
+            value = exif[start : start + count]
+            return value.split(b"\0", 1)[0].decode("ascii", errors="replace")
+    except struct.error:
+        # truncated or corrupt data
+        return None
+    return None
+
+
+def _date_from_exif(value: str) -> datetime.date:
+    """Get the date from an EXIF date-time, formatted as 'YYYY:MM:DD HH:MM:SS'.
+
+    The format is fixed, so slicing it is much faster than a generic parser.
+
+    :raises: ValueError in case value does not start with a valid date
+    """
+    return datetime.date(int(value[0:4]), int(value[5:7]), int(value[8:10]))
+
 
 class RegexExtractor(Extractor):
     """
     Extract the date using a regex pattern in the filename.
     """
 
-    def __init__(self, pattern: re.Pattern, date_fmt: str, **kwargs):
+    def __init__(
+        self,
+        pattern: re.Pattern,
+        date_fmt: str,
+        prefix: Optional[str] = None,
+        **kwargs,
+    ):
         """Initialize RegexExtractor
 
         :param pattern: Regex pattern with at least one capture group. The first
             capture group should correspond to the date(time) part of the filename.
         :param date_fmt: Format-specifier to convert the extracted string to a
             pendulum datetime. Should be in pendulum format. Example 'YYYY-MM-DD'.
+        :param prefix: Literal prefix that pattern only matches filenames with, if
+            any. Filenames without it are rejected without running the pattern.
         :param kwargs: Additional keyword arguments passed to superclass
 
         """
@@ -79,8 +264,101 @@ class RegexExtractor(Extractor):
             raise ValueError("Supplied pattern does not contain a capture group")
         self.pattern = pattern
         self.date_fmt = date_fmt
+        self._strptime_fmt = _to_strptime_format(date_fmt)
+        self.prefix = prefix
+
+    @classmethod
+    @functools.lru_cache(maxsize=128)
+    def from_strings(
+        cls,
+        pattern: str,
+        date_fmt: str,
+        prefix: Optional[str] = None,
+        ignore_errors: bool = False,
+    ) -> "RegexExtractor":
+        """Get an extractor for a pattern that is yet to be compiled.
+
+        Extractors are cached, so calling this repeatedly with the same arguments
+        compiles the pattern and translates the date format only once.
+
+        :param pattern: Regex pattern with at least one capture group, see
+            `__init__`.
+        :param date_fmt: Format-specifier in pendulum format, see `__init__`.
+        :param prefix: Literal prefix of matching filenames, see `__init__`.
+        :param ignore_errors: See `Extractor.__init__`.
+        :return: A shared extractor, which should not be modified.
+        """
+        return cls(
+            re.compile(pattern), date_fmt, prefix=prefix, ignore_errors=ignore_errors
+        )
+
+    def extract(
+        self,
+        path: pathlib.Path,
+        header: Optional[bytes] = None,
+        stat: Optional[os.stat_result] = None,
+    ) -> Optional[datetime.date]:
+        """Extract date from path using regex.
 
-    def extract(self, path: pathlib.Path) -> Optional[datetime.date]:
+        :param path: Path to image or video.
+        :return: Extracted date when there is a match, None otherwise.
+        :raises: ValueError when date format specifier does not match extracted
+            capture group field.
+        """
+        name = path.name
+        if self.prefix is not None and not name.startswith(self.prefix):
+            return None
+        match = self.pattern.match(name)
+
+        if match is None:
+            return None
+
+        return _date_from_format(
+            path,
+            match.group(1),
+            self.date_fmt,
+            self._strptime_fmt,
+            self.ignore_errors,
+        )
+
+
+class MultiRegexExtractor(Extractor):
+    """
+    Extract the date using one of several regex patterns in the filename.
+
+    The patterns are alternatives of a single regex, so a filename only has to be
+    matched once, however many patterns there are.
+    """
+
+    def __init__(self, pattern: re.Pattern, date_fmts: Mapping[str, str], **kwargs):
+        """Initialize MultiRegexExtractor
+
+        :param pattern: Regex pattern of alternatives. Each alternative should have
+            exactly one capture group, named, corresponding to the date(time) part
+            of the filename.
+        :param date_fmts: Format-specifiers to convert the extracted string to a
+            pendulum datetime, by capture group name. Should be in pendulum format.
+        :param kwargs: Additional keyword arguments passed to superclass
+        """
+        super().__init__(**kwargs)
+        if not pattern.groupindex:
+            raise ValueError("Supplied pattern does not contain a named capture group")
+        missing = set(pattern.groupindex) - set(date_fmts)
+        if missing:
+            raise ValueError(f"No date format supplied for capture groups {missing}")
+        self.pattern = pattern
+        self.date_fmts = date_fmts
+        self._strptime_fmts = {
+            group: _to_strptime_format(date_fmt)
+            for group, date_fmt in date_fmts.items()
+        }
+
+    def extract(
+        self,
+        path: pathlib.Path,
+        header: Optional[bytes] = None,
+        stat: Optional[os.stat_result] = None,
+    ) -> Optional[datetime.date]:
         """Extract date from path using regex.
 
         :param path: Path to image or video.
@@ -90,20 +368,165 @@ class RegexExtractor(Extractor):
         """
         match = self.pattern.match(path.name)
 
-        if match is None:
+        if match is None or match.lastgroup is None:
             return None
 
-        try:
-            dt = pendulum.from_format(match.group(1), self.date_fmt)
-        except ValueError:
-            logger.exception(
-                f"Could not extract date of {path.name} using pattern {self.date_fmt}"
+        return _date_from_format(
+            path,
+            match.group(match.lastgroup),
+            self.date_fmts[match.lastgroup],
+            self._strptime_fmts[match.lastgroup],
+            self.ignore_errors,
+        )
+
+
+# Pendulum format tokens with an exact strptime equivalent.
+_STRPTIME_TOKENS = {
+    "YYYY": "%Y",
+    "MM": "%m",
+    "DD": "%d",
+    "HH": "%H",
+    "mm": "%M",
+    "ss": "%S",
+}
+# Runs of the same letter are a single token, e.g. 'MMMM' is not 'MM' twice.
+_PENDULUM_TOKEN_PATTERN = re.compile(r"([A-Za-z])\1*|[^A-Za-z]+")
+
+
+def _to_strptime_format(date_fmt: str) -> Optional[str]:
+    """Translate a pendulum format to a strptime format.
+
+    Parsing with strptime is much faster than with pendulum, which builds and
+    interprets a list of tokens on every call.
+
+    :return: The strptime format, or None when date_fmt has tokens that strptime
+        has no exact equivalent for.
+    """
+    translated = []
+    for match in _PENDULUM_TOKEN_PATTERN.finditer(date_fmt):
+        token = match.group(0)
+        if token in _STRPTIME_TOKENS:
+            translated.append(_STRPTIME_TOKENS[token])
+        elif token.isalpha():
+            return None
+        else:
+            translated.append(token.replace("%", "%%"))
+    return "".join(translated)
+
+
+def _date_from_format(
+    path: pathlib.Path,
+    value: str,
+    date_fmt: str,
+    strptime_fmt: Optional[str],
+    ignore_errors: bool,
+) -> Optional[datetime.date]:
+    try:
+        if strptime_fmt is not None:
+            return datetime.datetime.strptime(value, strptime_fmt).date()
+        return pendulum.from_format(value, date_fmt).date()
+    except ValueError:
+        logger.exception(
+            f"Could not extract date of {path.name} using pattern {date_fmt}"
+        )
+        if ignore_errors:
+            return None
+        raise
+
+
+class ExifToolBatch:
+    """Extract dates of many files using a single, persistent exiftool process.
+
+    Starting exiftool is expensive, so rather than starting it for every file, we
+    keep it running in `-stay_open` mode and feed it batches of files. Exiftool must
+    be on the PATH. Use as a context manager, or call `close` when done.
+
+    Paths are passed to exiftool as bytes, so filenames that are not valid UTF-8 are
+    passed on unchanged.
+    """
+
+    def __init__(self) -> None:
+        """Start exiftool
+
+        :raises: FileNotFoundError in case exiftool was not found on the PATH
+        """
+        self._lock = threading.Lock()
+        self._process = subprocess.Popen(
+            ["exiftool", "-stay_open", "True", "-@", "-"],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+        )
+
+    def get_dates(
+        self, paths: Sequence[pathlib.Path]
+    ) -> Dict[pathlib.Path, Optional[datetime.date]]:
+        """Get the create dates of a batch of files.
+
+        :param paths: Paths of images or videos.
+        :return: Date per path, None for paths without a valid create date. Paths
+            exiftool failed to read are left out, as are paths containing a newline,
+            which cannot be passed to exiftool line by line.
+        :raises: ValueError in case the output of exiftool is not valid JSON
+        """
+        # Arguments are read one per line.
+        by_name = {str(path): path for path in paths if "\n" not in str(path)}
+        if not by_name:
+            return {}
+        args = ["-json", "-CreateDate", *by_name, "-execute"]
+
+        lines = []
+        with self._lock:
+            assert self._process.stdin is not None
+            assert self._process.stdout is not None
+            self._process.stdin.write(b"\n".join(map(os.fsencode, args)) + b"\n")
+            self._process.stdin.flush()
+            for line in self._process.stdout:
+                if line.rstrip() == b"{ready}":
+                    break
+                lines.append(line)
+
+        # exiftool writes filenames as it got them, decode them the same way paths
+        # are, so that they compare equal.
+        output = os.fsdecode(b"".join(lines)).strip()
+        dates: Dict[pathlib.Path, Optional[datetime.date]] = {}
+        for record in json.loads(output) if output else []:
+            path = by_name.get(record["SourceFile"])
+            if path is None:
+                continue
+            date_field = record.get("CreateDate")
+            dates[path] = (
+                _date_from_exiftool(path, str(date_field)) if date_field else None
             )
-            if self.ignore_errors:
-                return None
-            raise
+        return dates
 
-        return dt.date()
+    def close(self) -> None:
+        """Stop exiftool"""
+        if self._process.poll() is None:
+            assert self._process.stdin is not None
+            try:
+                self._process.stdin.write(b"-stay_open\nFalse\n")
+                self._process.stdin.flush()
+            except BrokenPipeError:
+                pass  # exiftool is exiting already
+            self._process.wait()
+
+    def __enter__(self) -> "ExifToolBatch":
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+
+def _date_from_exiftool(path: pathlib.Path, date_field: str) -> Optional[datetime.date]:
+    try:
+        return _date_from_exif(date_field.strip())
+    except ValueError:
+        logger.warning(
+            f"Could not determine exif-provided date for {path}. "
+            f"{date_field} is not a valid date-time."
+        )
+        return None
 
 
 class ExifToolExtractor(Extractor):
@@ -112,9 +535,62 @@ class ExifToolExtractor(Extractor):
     This is especially relevant for videos, as PIL does not parse videos, we
     have to use another approach here. Exiftool must be on the PATH for this
     extractor to work.
+
+    Dates of prefetched files are extracted in batches by a single exiftool
+    process, other files get an exiftool process of their own.
     """
 
-    def extract(self, path: pathlib.Path) -> Optional[datetime.date]:
+    def __init__(self, **kwargs) -> None:
+        """Initialize ExifToolExtractor
+
+        :param kwargs: Additional keyword arguments passed to superclass
+        """
+        super().__init__(**kwargs)
+        self._batch: Optional[ExifToolBatch] = None
+        self._prefetched: Dict[pathlib.Path, Optional[datetime.date]] = {}
+
+    def extract_many(
+        self, paths: Sequence[pathlib.Path]
+    ) -> Dict[pathlib.Path, Optional[datetime.date]]:
+        """Extract the dates of many files at once.
+
+        All calls share a single exiftool process, which is kept running until
+        `close` is called.
+
+        :param paths: Paths of images or videos.
+        :return: Date per path, None for paths without a valid create date. Paths
+            exiftool failed to read are left out.
+        :raises: FileNotFoundError in case exiftool was not found on the PATH
+        """
+        if self._batch is None:
+            self._batch = ExifToolBatch()
+        return self._batch.get_dates(paths)
+
+    def prefetch(self, paths: Sequence[pathlib.Path]) -> None:
+        try:
+            self._prefetched.update(self.extract_many(paths))
+        except FileNotFoundError:
+            # extract will report this for every file
+            pass
+        except (OSError, ValueError):
+            # The files are extracted one by one instead.
+            logger.exception("Exiftool failed to extract a batch of files.")
+            if self._batch is not None:
+                self._batch.close()
+                self._batch = None
+
+    def close(self) -> None:
+        if self._batch is not None:
+            self._batch.close()
+            self._batch = None
+        self._prefetched.clear()
+
+    def extract(
+        self,
+        path: pathlib.Path,
+        header: Optional[bytes] = None,
+        stat: Optional[os.stat_result] = None,
+    ) -> Optional[datetime.date]:
         """Extract the date
 
         :param path: Path of image or video
@@ -123,9 +599,16 @@ class ExifToolExtractor(Extractor):
         :raises: CalledProcessError when exiftool gives a non-zero exit code
         :raises: FileNotFoundError in case exiftool was not found on the PATH
         """
+        try:
+            return self._prefetched.pop(path)
+        except KeyError:
+            pass
+
         try:
             proc_return = subprocess.run(
-                ["exiftool", path], capture_output=True, text=True, check=True
+                ["exiftool", "-CreateDate", "-s", "-s", "-s", path],
+                capture_output=True,
+                check=True,
             )
         except subprocess.CalledProcessError:
             logger.exception(f"Exiftool had a non-zero exit code for file {path}")
@@ -138,31 +621,28 @@ class ExifToolExtractor(Extractor):
                 return None
             raise
 
-        date: Optional[datetime.date] = None
-        for line in proc_return.stdout.splitlines():
-            if line.startswith("Create Date"):
-                _, _, date_field = line.partition(":")
-                try:
-                    date = cast(
-                        pendulum.DateTime, pendulum.parse(date_field.strip())
-                    ).date()
-                except ValueError:
-                    logger.warning(
-                        f"Could not determine exif-provided date for {path}. "
-                        f"{date_field} is not a valid date-time."
-                    )
-
-        return date
+        # With -s -s -s exiftool prints just the value, if the file has a CreateDate.
+        date_field = proc_return.stdout.strip()
+        if not date_field:
+            return None
+        return _date_from_exiftool(path, date_field.decode("utf-8", errors="replace"))
 
 
 class MTimeExtractor(Extractor):
     """Simple extractor based on mtime"""
 
-    def extract(self, path: pathlib.Path) -> Optional[datetime.date]:
+    def extract(
+        self,
+        path: pathlib.Path,
+        header: Optional[bytes] = None,
+        stat: Optional[os.stat_result] = None,
+    ) -> Optional[datetime.date]:
         """Extract date
 
         :param path: Path to file
         :return: Date of modified time of the file.
         """
-        dt = pendulum.from_timestamp(path.stat().st_mtime)
+        if stat is None:
+            stat = path.stat()
+        dt = pendulum.from_timestamp(stat.st_mtime)
         return dt.date()
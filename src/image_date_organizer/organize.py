@@ -6,44 +6,123 @@ image_date_organizer.organize
 :license: BSD-3-clause
 """
 import datetime
+import functools
+import inspect
+import os
 import pathlib
 import re
 import shutil
+import threading
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
 from pathlib import Path
-from typing import Optional, Sequence
+from typing import (
+    Dict,
+    FrozenSet,
+    Iterator,
+    List,
+    Literal,
+    Optional,
+    Sequence,
+    Tuple,
+    Type,
+)
 
 import magic
 from loguru import logger
 
 from .extractors import (
+    HEADER_SIZE,
     ExifImageExtractor,
     ExifToolExtractor,
     Extractor,
     MTimeExtractor,
-    RegexExtractor,
+    MultiRegexExtractor,
 )
-from .utils import sha256_file
+from .utils import MetadataCache, copy_and_hash, copy_fileobj, sha256_file
 
 DEFAULT_IMAGE_EXTRACTORS = [
     ExifImageExtractor(),
-    # e.g. '20200101_120101.jpg'
-    RegexExtractor(re.compile(r"(\d{8}_\d{6})"), "YYYYMMDD_HHmmss"),
-    # e.g. 'Screenshot_20200101-120101_Maps.jpg'
-    RegexExtractor(re.compile(r"Screenshot_(\d{8}-\d{6})_\w.+"), "YYYYMMDD-HHmmss"),
-    # e.g. 'IMG-20200101-WA0001.jpg'
-    RegexExtractor(re.compile(r"IMG-(\d{8})-WA\d+"), "YYYYMMDD"),
+    MultiRegexExtractor(
+        re.compile(
+            r"""
+            # e.g. '20200101_120101.jpg'
+            ^(?P<datetime>\d{8}_\d{6})
+            # e.g. 'Screenshot_20200101-120101_Maps.jpg'
+            | ^Screenshot_(?P<screenshot>\d{8}-\d{6})_
+            # e.g. 'IMG-20200101-WA0001.jpg'
+            | ^IMG-(?P<whatsapp>\d{8})-WA\d
+            """,
+            re.VERBOSE | re.ASCII,
+        ),
+        {
+            "datetime": "YYYYMMDD_HHmmss",
+            "screenshot": "YYYYMMDD-HHmmss",
+            "whatsapp": "YYYYMMDD",
+        },
+    ),
     MTimeExtractor(),
 ]
 
 DEFAULT_VIDEO_EXTRACTORS = [
     ExifToolExtractor(),
-    # e.g. 'VID-20200101-WA0001.mp4'
-    RegexExtractor(re.compile(r"VID-(\d{8})-WA\d+"), "YYYYMMDD"),
-    # E.g. # e.g. '20200101_120101.mp4'
-    RegexExtractor(re.compile(r"(\d{8}_\d{6})"), "YYYYMMDD_HHmmss"),
+    MultiRegexExtractor(
+        re.compile(
+            r"""
+            # e.g. 'VID-20200101-WA0001.mp4'
+            ^VID-(?P<whatsapp>\d{8})-WA\d
+            # e.g. '20200101_120101.mp4'
+            | ^(?P<datetime>\d{8}_\d{6})
+            """,
+            re.VERBOSE | re.ASCII,
+        ),
+        {
+            "whatsapp": "YYYYMMDD",
+            "datetime": "YYYYMMDD_HHmmss",
+        },
+    ),
     MTimeExtractor(),
 ]
 
+# Files with these extensions are taken to be images without sniffing them.
+IMAGE_SUFFIXES = frozenset(
+    {
+        ".jpg",
+        ".jpeg",
+        ".png",
+        ".heic",
+        ".heif",
+        ".tiff",
+        ".tif",
+        ".webp",
+        ".gif",
+        ".bmp",
+        ".cr2",
+        ".nef",
+        ".arw",
+        ".dng",
+    }
+)
+
+# Files with these extensions are taken to be mp4 videos without sniffing them.
+VIDEO_SUFFIXES = frozenset({".mp4"})
+
+# libmagic instances, by thread.
+_magic_instances = threading.local()
+
+# Optional keyword arguments that extractors may accept, see Extractor.extract.
+HINTS = frozenset({"header", "stat"})
+
+# Kinds of files, as classified by _classify. Only images and mp4 videos can be
+# organized, other files are skipped.
+FileKind = Literal["image", "mp4", "other"]
+
+# Number of files for which extractors may prefetch dates at once.
+BATCH_SIZE = 200
+
+# Organizing is I/O bound, so we can use many more threads than there are cores.
+DEFAULT_MAX_WORKERS = min(32, (os.cpu_count() or 1) * 4)
+
 
 class Organizer:
     """
@@ -59,6 +138,11 @@ class Organizer:
         video_extractors: Sequence[Extractor] = (),
         dry_run: bool = False,
         remove_source: bool = False,
+        max_workers: Optional[int] = None,
+        verify: bool = False,
+        cache: Optional[MetadataCache] = None,
+        parallel: bool = True,
+        hardlink: bool = False,
     ) -> None:
         """Initialize organizer
 
@@ -74,84 +158,179 @@ class Organizer:
             are printed, but we won't actually copy over any files.
         :param remove_source: Whether to remove the source path(s) after copying is
             complete. This parameter is ignored when `dry_run` is set to True.
+        :param max_workers: Maximum number of threads used to organize files of a
+            directory concurrently. Defaults to `DEFAULT_MAX_WORKERS`.
+        :param verify: Whether to verify that the contents of copied files are
+            identical to their source by comparing checksums. Copies are always
+            verified when `remove_source` is set.
+        :param cache: Cache of extracted dates. Files that did not change since
+            their date was cached do not need any extraction.
+        :param parallel: Whether to organize files of a directory concurrently. When
+            set to False, files are organized one by one in the calling thread.
+        :param hardlink: Whether to hardlink files rather than copy them, when the
+            destination is on the same filesystem as the source. The destination
+            then shares its contents with the source. Files are always linked rather
+            than copied when `remove_source` is set, since that amounts to a move.
         """
         self.image_extractors = image_extractors
         self.video_extractors = video_extractors
         self.dry_run = dry_run
+        self.max_workers = max_workers or DEFAULT_MAX_WORKERS
+        self.verify = verify
+        self.cache = cache
+        self.parallel = parallel
+        self.hardlink = hardlink
+
+        # Date directories known to exist, by destination and date. Files of a date
+        # we have seen before need neither path construction nor a mkdir.
+        self._date_dirs: Dict[Tuple[Path, datetime.date], Path] = {}
 
         self.remove_source = remove_source if not self.dry_run else False
 
-    def extract_date(self, path: pathlib.Path) -> Optional[datetime.date]:
+    def extract_date(
+        self,
+        path: pathlib.Path,
+        header: Optional[bytes] = None,
+        stat: Optional[os.stat_result] = None,
+        kind: Optional[FileKind] = None,
+    ) -> Optional[datetime.date]:
         """Extract the date of a single file
 
         :param path: path of file for which we should extract the date.
+        :param header: Leading bytes of the file. Will be read from path when not
+            given.
+        :param stat: Stat result of the file, if already known.
+        :param kind: Kind of the file, if already classified. The file is
+            classified when None.
         :return: Date if file is an image or video and it can be extracted,
             None otherwise.
         """
-        if is_image(path):
-            return self._extract_image_date(path)
-        if is_mp4(path):
-            return self._extract_video_date(path)
+        if kind is None:
+            if header is None and path.suffix.lower() not in VIDEO_SUFFIXES:
+                # Needed for sniffing unknown files, and for image metadata.
+                header = _probe_header(path)
+            kind = _classify(path, header)
+        if kind == "image":
+            return self._extract_image_date(path, header, stat)
+        if kind == "mp4":
+            return self._extract_video_date(path, header, stat)
         logger.warning(f"{path} is not an image or video, skipping...")
         return None
 
+    def _extract_cached_date(
+        self, path: pathlib.Path, stat: os.stat_result, kind: Optional[FileKind]
+    ) -> Optional[datetime.date]:
+        if self.cache is None:
+            return self.extract_date(path, stat=stat, kind=kind)
+
+        date = self.cache.get_date(path, stat)
+        if date is not None:
+            logger.debug(f"Using cached date for {path}")
+            return date
+
+        date = self.extract_date(path, stat=stat, kind=kind)
+        if date is not None:
+            self.cache.set_date(path, stat, date)
+        return date
+
     def _extract_file_date(
-        self, path: pathlib.Path, extractors: Sequence[Extractor]
+        self,
+        path: pathlib.Path,
+        header: Optional[bytes],
+        stat: Optional[os.stat_result],
+        extractors: Sequence[Extractor],
     ) -> Optional[datetime.date]:
+        hints = {"header": header, "stat": stat}
         for extractor in extractors:
             logger.debug(f"Attempting extractor {extractor.__class__.__name__}")
-            extraction = extractor.extract(path)
+            accepted = _hint_parameters(type(extractor))
+            extraction = extractor.extract(
+                path, **{name: hints[name] for name in accepted}
+            )
             if extraction is not None:
                 return extraction
 
         logger.info("Could not determine date for any extractor.")
         return None
 
-    def _extract_image_date(self, path: pathlib.Path) -> Optional[datetime.date]:
-        return self._extract_file_date(path, self.image_extractors)
+    def _extract_image_date(
+        self,
+        path: pathlib.Path,
+        header: Optional[bytes],
+        stat: Optional[os.stat_result],
+    ) -> Optional[datetime.date]:
+        return self._extract_file_date(path, header, stat, self.image_extractors)
 
-    def _extract_video_date(self, path: pathlib.Path) -> Optional[datetime.date]:
-        return self._extract_file_date(path, self.video_extractors)
+    def _extract_video_date(
+        self,
+        path: pathlib.Path,
+        header: Optional[bytes],
+        stat: Optional[os.stat_result],
+    ) -> Optional[datetime.date]:
+        return self._extract_file_date(path, header, stat, self.video_extractors)
 
     def organize(self, source: Path, destination: Path) -> None:
         """Main organizer"""
-        if source.is_file():
-            logger.debug(f"{source} is a file")
-            self.organize_file(source, destination)
-        elif source.is_dir():
-            logger.debug(f"{source} is a directory")
-            self.organize_dir(source, destination)
-        else:
-            raise NotImplementedError
+        self._date_dirs.clear()
+        try:
+            if source.is_file():
+                logger.debug(f"{source} is a file")
+                self.organize_file(source, destination)
+            elif source.is_dir():
+                logger.debug(f"{source} is a directory")
+                self.organize_dir(source, destination)
+            else:
+                raise NotImplementedError
+        finally:
+            if self.cache is not None:
+                self.cache.commit()
 
     def organize_file(
         self,
         source: Path,
         destination: Path,
+        entry: Optional["os.DirEntry[str]"] = None,
+        kind: Optional[FileKind] = None,
     ) -> None:
-        """Organize a single file."""
+        """Organize a single file.
+
+        :param entry: Directory entry of source, when found by scanning a directory.
+            Its cached stat result is reused.
+        :param kind: Kind of source, if already classified. None when unknown.
+        """
         logger.debug(f"Organizing {source}")
-        date = self.extract_date(source)
+        stat = entry.stat() if entry is not None else source.stat()
+        date = self._extract_cached_date(source, stat, kind)
 
         if date is None:
             return
 
-        dest_dir = create_date_path(destination, date)
+        dest_dir = self._date_dirs.get((destination, date))
+        if dest_dir is None:
+            dest_dir = create_date_path(destination, date)
+            dest_dir.mkdir(parents=True, exist_ok=True)  # ensure dir exists
+            self._date_dirs[(destination, date)] = dest_dir
 
         dest_path = dest_dir / source.name
         logger.debug(f"Determined destination path as {dest_path}")
-        dest_dir.mkdir(parents=True, exist_ok=True)  # ensure dir exists
-        if dest_path.exists():
-            logger.warning(f"{source.name} already exists on destination, skipping")
-            return  # skipping, since it already exists.
-        logger.info(f"Copying {source} to {dest_path}")
-
         # Return early if we are doing a dry run.
         if self.dry_run:
+            if dest_path.exists():
+                logger.warning(f"{source.name} already exists on destination, skipping")
+            else:
+                logger.info(f"Copying {source} to {dest_path}")
             return
 
         try:
-            verify_copy(source, dest_path)
+            if (self.hardlink or self.remove_source) and link_file(source, dest_path):
+                logger.info(f"Linked {source} to {dest_path}")
+            else:
+                logger.info(f"Copying {source} to {dest_path}")
+                # Never remove a source of which the copy was not verified.
+                verify_copy(source, dest_path, verify=self.verify or self.remove_source)
+        except FileExistsError:
+            logger.warning(f"{source.name} already exists on destination, skipping")
+            return  # skipping, since it already exists.
         except ValueError:
             logger.exception(f"Failed to copy {source} to {dest_path}")
             raise
@@ -164,48 +343,216 @@ class Organizer:
         """
         Recursively organize a directory.
 
-        :raises: RuntimeError when trying to process extremely deep directory tree.
+        Files are organized concurrently on a pool of threads, unless `parallel` is
+        False. Directories are only removed once all files have been organized.
         """
         logger.debug(f"Organizing {source}")
-        for item in source.iterdir():
-            if item.is_file():
-                self.organize_file(item, destination)
-            elif item.is_dir():
-                # a little recursion
-                self.organize_dir(item, destination)
-            else:
-                # skipping due to don't know how to handle
-                continue
+        directories: List[Path] = []
+        try:
+            with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                futures: List[Future] = []
+                batch: List["os.DirEntry[str]"] = []
+                for entry in _iter_files(source, directories):
+                    batch.append(entry)
+                    if len(batch) >= BATCH_SIZE:
+                        futures.extend(self._submit_batch(executor, batch, destination))
+                        batch = []
+                futures.extend(self._submit_batch(executor, batch, destination))
+
+                try:
+                    for future in as_completed(futures):
+                        future.result()  # re-raises any exception of the worker
+                except Exception:
+                    for future in futures:
+                        future.cancel()
+                    raise
+        finally:
+            for extractor in self._extractors():
+                extractor.close()
 
         if self.remove_source and not self.dry_run:
-            try:
-                source.rmdir()
-            except OSError as error:
-                if str(error).startswith("[Errno 39]"):
-                    # means directory is not empty.
-                    # should warn that source is unremovable.
-                    pass
-                else:
-                    raise
+            # Parents are visited before their children, so go in reverse order to
+            # remove the deepest directories first.
+            for directory in reversed(directories):
+                self._remove_dir(directory)
 
+    def _submit_batch(
+        self,
+        executor: ThreadPoolExecutor,
+        entries: Sequence["os.DirEntry[str]"],
+        destination: Path,
+    ) -> List[Future]:
+        """Let extractors prefetch dates of a batch of files, then organize them."""
+        paths = [Path(entry.path) for entry in entries]
+        kinds = self._prefetch(paths, entries)
+        if not self.parallel:
+            for path, entry, kind in zip(paths, entries, kinds):
+                self.organize_file(path, destination, entry, kind)
+            return []
+        return [
+            executor.submit(self.organize_file, path, destination, entry, kind)
+            for path, entry, kind in zip(paths, entries, kinds)
+        ]
+
+    def _prefetch(
+        self, paths: Sequence[Path], entries: Sequence["os.DirEntry[str]"]
+    ) -> List[Optional[FileKind]]:
+        """Let image and video extractors prefetch the dates of their files.
+
+        Files with a cached date need no extraction, so they are neither classified
+        nor prefetched.
+
+        :return: Kind of each path, so that files need to be classified only once.
+            None for files with a cached date, which are not classified.
+        """
+        kinds = [
+            None if self._is_cached(path, entry) else _classify(path)
+            for path, entry in zip(paths, entries)
+        ]
+        images = [path for path, kind in zip(paths, kinds) if kind == "image"]
+        videos = [path for path, kind in zip(paths, kinds) if kind == "mp4"]
+
+        if images:
+            for extractor in self.image_extractors:
+                extractor.prefetch(images)
+        if videos:
+            for extractor in self.video_extractors:
+                extractor.prefetch(videos)
+        return kinds
+
+    def _is_cached(self, path: Path, entry: "os.DirEntry[str]") -> bool:
+        return self.cache is not None and (
+            self.cache.get_date(path, entry.stat()) is not None
+        )
+
+    def _extractors(self) -> List[Extractor]:
+        """All distinct image and video extractors."""
+        extractors: List[Extractor] = []
+        for extractor in [*self.image_extractors, *self.video_extractors]:
+            if not any(extractor is known for known in extractors):
+                extractors.append(extractor)
+        return extractors
+
+    @staticmethod
+    def _remove_dir(directory: Path) -> None:
+        try:
+            directory.rmdir()
+        except OSError as error:
+            if str(error).startswith("[Errno 39]"):
+                # means directory is not empty.
+                # should warn that source is unremovable.
+                pass
+            else:
+                raise
 
-def is_image(path: Path) -> bool:
-    mimetype = magic.from_file(str(path), mime=True)
-    return mimetype.split("/")[0] == "image"
 
+def _iter_files(
+    root: Path, directories: Optional[List[Path]] = None
+) -> Iterator["os.DirEntry[str]"]:
+    """Recursively iterate over the files in a directory.
 
-def is_mp4(path: Path) -> bool:
-    mimetype = magic.from_file(str(path), mime=True)
-    return mimetype == "video/mp4"
+    The tree is walked with an explicit stack rather than recursion, so that there
+    is no limit on its depth. The entries returned by os.scandir know whether they
+    are a file or a directory without a stat call. Symlinks to directories are not
+    followed, and entries that are neither files nor directories are skipped.
 
+    :param root: Directory to walk.
+    :param directories: If given, every directory walked is appended to it, parents
+        before their children.
+    """
+    pending = deque([root])
+    while pending:
+        directory = pending.pop()
+        if directories is not None:
+            directories.append(directory)
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    pending.append(Path(entry.path))
+                elif entry.is_file():
+                    yield entry
+
+
+@functools.lru_cache(maxsize=None)
+def _hint_parameters(extractor_type: Type[Extractor]) -> FrozenSet[str]:
+    """Get the optional keyword arguments that extract of an extractor accepts.
+
+    Extractors are only required to accept a path, so the header and stat result
+    are only passed to extractors that accept them.
+    """
+    parameters = inspect.signature(extractor_type.extract).parameters.values()
+    if any(parameter.kind is parameter.VAR_KEYWORD for parameter in parameters):
+        return HINTS
+    return HINTS & {
+        parameter.name
+        for parameter in parameters
+        if parameter.kind in (parameter.POSITIONAL_OR_KEYWORD, parameter.KEYWORD_ONLY)
+    }
 
-def verify_copy(source: Path, destination: Path) -> None:
+
+def _probe_header(path: Path, size: int = HEADER_SIZE) -> bytes:
+    """Read the leading bytes of a file."""
+    with path.open("rb") as handle:
+        return handle.read(size)
+
+
+def _mime_magic() -> magic.Magic:
+    """Get the libmagic instance of the current thread.
+
+    Loading the magic database is expensive, so every thread keeps its instance
+    around. Instances are not shared, as each serializes its calls with a lock.
+    """
+    instance = getattr(_magic_instances, "mime", None)
+    if instance is None:
+        instance = _magic_instances.mime = magic.Magic(mime=True)
+    return instance
+
+
+def _mimetype(path: Path, header: Optional[bytes] = None) -> str:
+    if header is not None:
+        return _mime_magic().from_buffer(header)
+    return _mime_magic().from_file(str(path))
+
+
+def _classify(path: Path, header: Optional[bytes] = None) -> FileKind:
+    """Classify a file as either an image, an mp4 video, or neither.
+
+    Well-known extensions are trusted, only other files are sniffed with libmagic.
+    """
+    suffix = path.suffix.lower()
+    if suffix in IMAGE_SUFFIXES:
+        return "image"
+    if suffix in VIDEO_SUFFIXES:
+        return "mp4"
+    mimetype = _mimetype(path, header)
+    if mimetype.split("/")[0] == "image":
+        return "image"
+    if mimetype == "video/mp4":
+        return "mp4"
+    return "other"
+
+
+def is_image(path: Path, header: Optional[bytes] = None) -> bool:
+    return _classify(path, header) == "image"
+
+
+def is_mp4(path: Path, header: Optional[bytes] = None) -> bool:
+    return _classify(path, header) == "mp4"
+
+
+def verify_copy(source: Path, destination: Path, verify: bool = True) -> None:
     """
     Copy a file, verifying that the copied file's contents are identical
     to the source contents.
 
+    The source is hashed while it is being copied, so it is only read once.
+    When `verify` is False, the file is copied without computing any checksums.
+
+    The destination is created exclusively, so an existing file is never
+    overwritten, without having to check for its existence first.
+
     Will attempt to copy metadata as well, with the caveats listed in:
-    https://docs.python.org/3.7/library/shutil.html#shutil.copy2
+    https://docs.python.org/3.7/library/shutil.html#shutil.copystat
 
     In case the contents do not match, we will attempt to remove the
     destination if it is a file, after which a ValueError is thrown.
@@ -213,21 +560,46 @@ def verify_copy(source: Path, destination: Path) -> None:
     :raises: ValueError in case contents do not match
     :raises: ValueError in case source is not a file
     :raises: ValueError in case destination is a directory.
+    :raises: FileExistsError in case destination already exists.
     :raises: OSError in case file's can't be written.
     """
     if not source.is_file():
         raise ValueError("Source must be a file")
     if destination.is_dir():
         raise ValueError("Destination may not be a directory")
-    source_sha256 = sha256_file(source)
-    copied = Path(shutil.copy2(source, destination))
-    dest_sha256 = sha256_file(copied)
+    if not verify:
+        with source.open("rb") as src_handle, destination.open("xb") as dest_handle:
+            copy_fileobj(src_handle, dest_handle)
+        shutil.copystat(source, destination)
+        return
+    source_sha256 = copy_and_hash(source, destination)
+    shutil.copystat(source, destination)
+    dest_sha256 = sha256_file(destination)
     if source_sha256 != dest_sha256:
-        if copied.is_file():
-            copied.unlink()
+        if destination.is_file():
+            destination.unlink()
         raise ValueError("Source' and destination's contents did not match!")
 
 
+def link_file(source: Path, destination: Path) -> bool:
+    """Hardlink destination to source, if both are on the same filesystem.
+
+    Linking only touches directory entries, so no contents need to be copied or
+    verified. An existing destination is never overwritten.
+
+    :return: False in case the file could not be linked, e.g. because destination is
+        on another filesystem, or the filesystem does not support hardlinks.
+    :raises: FileExistsError in case destination already exists.
+    """
+    try:
+        os.link(source, destination)
+    except FileExistsError:
+        raise
+    except OSError:
+        return False
+    return True
+
+
 def create_date_path(root: Path, date: datetime.date) -> Path:
     """Create path form a root path and a date."""
-    return root / Path(str(date.year)) / Path(str(date.month)) / Path(str(date.day))
+    return root.joinpath(str(date.year), str(date.month), str(date.day))
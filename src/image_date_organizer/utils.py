@@ -5,24 +5,191 @@ image_date_organizer.utils
 :copyright: (c) 2019-2021 Sander Bollen
 :license: BSD-3-clause
 """
+import datetime
 import hashlib
+import mmap
+import os
+import shutil
+import sqlite3
+import sys
+import threading
 from pathlib import Path
+from typing import BinaryIO, Callable, Optional
 
 import pkg_resources
 
+DEFAULT_CACHE_PATH = Path("~/.cache/image-date-organizer.db").expanduser()
+
+
+# Files smaller than this are read into memory to hash them, as setting up and
+# tearing down a memory mapping costs more than reading a few chunks.
+MMAP_THRESHOLD = 1024 * 1024
+
 
 def get_package_version():
     return pkg_resources.get_distribution("image_date_organizer").version
 
 
-def sha256_file(path: Path, chunksize: int = 4 * 1024 * 1024) -> str:
+def sha256_file(path: Path, chunksize: int = 1024 * 1024) -> str:
     if chunksize < 1:
         raise ValueError("Chunksize must be at least 1.")
-    hasher = hashlib.sha256()
     with path.open("rb") as handle:
-        while True:
-            data = handle.read(chunksize)
-            if not data:
-                break
+        if os.fstat(handle.fileno()).st_size >= MMAP_THRESHOLD:
+            try:
+                # Hash the memory-mapped file in a single call, letting the kernel
+                # page in the data on demand.
+                with mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                    if hasattr(mmap, "MADV_SEQUENTIAL"):
+                        mapped.madvise(mmap.MADV_SEQUENTIAL)
+                    return hashlib.sha256(mapped).hexdigest()
+            except (OSError, ValueError, OverflowError):
+                # e.g. files larger than the address space.
+                pass
+
+        if sys.version_info >= (3, 11):
+            # file_digest reads and hashes in C, without holding the GIL.
+            return hashlib.file_digest(handle, "sha256", _bufsize=chunksize).hexdigest()
+        hasher = hashlib.sha256()
+        while data := handle.read(chunksize):
+            hasher.update(data)
+        return hasher.hexdigest()
+
+
+def copy_and_hash(
+    source: Path, destination: Path, chunksize: int = 4 * 1024 * 1024
+) -> str:
+    """Copy the contents of source to a new file destination in a single pass.
+
+    :return: sha256 hex digest of the copied contents.
+    :raises: FileExistsError in case destination already exists.
+    """
+    if chunksize < 1:
+        raise ValueError("Chunksize must be at least 1.")
+    hasher = hashlib.sha256()
+    with source.open("rb") as src_handle, destination.open("xb") as dest_handle:
+        _advise_sequential(src_handle.fileno())
+        while data := src_handle.read(chunksize):
+            dest_handle.write(data)
             hasher.update(data)
     return hasher.hexdigest()
+
+
+def _advise_sequential(fd: int) -> None:
+    """Tell the kernel a file will be read sequentially, so it reads ahead more."""
+    if hasattr(os, "posix_fadvise"):
+        try:
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_SEQUENTIAL)
+        except OSError:
+            # e.g. pipes, or filesystems that don't support advice.
+            pass
+
+
+def copy_fileobj(source: BinaryIO, destination: BinaryIO) -> None:
+    """Copy the contents of an open file into another open file.
+
+    Within a single filesystem, os.copy_file_range is used, which lets
+    copy-on-write filesystems such as btrfs and XFS share (reflink) the data rather
+    than copy it. Otherwise, os.sendfile copies the data within the kernel. Both
+    release the GIL for the duration of each call. Falls back to
+    shutil.copyfileobj when neither is supported.
+    """
+    source_fd = source.fileno()
+    dest_fd = destination.fileno()
+    source_stat = os.fstat(source_fd)
+    size = source_stat.st_size
+    if (
+        hasattr(os, "copy_file_range")
+        and source_stat.st_dev == os.fstat(dest_fd).st_dev
+    ):
+        if _copy_in_kernel(
+            lambda offset, count: os.copy_file_range(
+                source_fd, dest_fd, count, offset, offset
+            ),
+            size,
+        ):
+            return
+    if hasattr(os, "sendfile"):
+        if _copy_in_kernel(
+            lambda offset, count: os.sendfile(dest_fd, source_fd, offset, count),
+            size,
+        ):
+            return
+    shutil.copyfileobj(source, destination)
+
+
+def _copy_in_kernel(copy: Callable[[int, int], int], size: int) -> bool:
+    """Copy size bytes in chunks, calling copy with an offset and a count.
+
+    :return: False in case copy is not supported, and nothing was copied.
+    """
+    offset = 0
+    try:
+        while offset < size:
+            copied = copy(offset, min(size - offset, 1 << 30))
+            if copied == 0:
+                break  # file shrunk while copying
+            offset += copied
+    except OSError:
+        # e.g. platforms or filesystems that don't support this kind of copy.
+        if offset > 0:
+            raise
+        return False
+    return True
+
+
+class MetadataCache:
+    """
+    Persistent cache of extracted dates, backed by sqlite.
+
+    Entries are keyed by path, and are only considered valid as long as the mtime
+    and size of the file did not change. The cache may be shared between threads.
+    Inserts are grouped in a single transaction until `commit` is called.
+    """
+
+    def __init__(self, path: Path = DEFAULT_CACHE_PATH) -> None:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(str(path), check_same_thread=False)
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS dates "
+            "(path TEXT PRIMARY KEY, mtime REAL, size INTEGER, date TEXT)"
+        )
+        self._connection.commit()
+
+    def get_date(self, path: Path, stat: os.stat_result) -> Optional[datetime.date]:
+        """Get the cached date of a file, None if not cached or outdated."""
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT date FROM dates WHERE path = ? AND mtime = ? AND size = ?",
+                (os.path.abspath(path), stat.st_mtime, stat.st_size),
+            ).fetchone()
+        if row is None:
+            return None
+        return datetime.date.fromisoformat(row[0])
+
+    def set_date(self, path: Path, stat: os.stat_result, date: datetime.date) -> None:
+        """Cache the date of a file."""
+        with self._lock:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO dates VALUES (?, ?, ?, ?)",
+                (
+                    os.path.abspath(path),
+                    stat.st_mtime,
+                    stat.st_size,
+                    date.isoformat(),
+                ),
+            )
+
+    def commit(self) -> None:
+        with self._lock:
+            self._connection.commit()
+
+    def close(self) -> None:
+        self.commit()
+        self._connection.close()
+
+    def __enter__(self) -> "MetadataCache":
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
@@ -1,9 +1,26 @@
+import datetime
+import json
+import os
 import re
+import shutil
+import subprocess
 from pathlib import Path
 
 import pytest
+from PIL import Image
 
-from image_date_organizer.extractors import ExifImageExtractor, RegexExtractor
+from image_date_organizer.extractors import (
+    ExifImageExtractor,
+    ExifToolBatch,
+    ExifToolExtractor,
+    MultiRegexExtractor,
+    RegexExtractor,
+    _date_from_exif,
+    _find_jpeg_exif,
+    _may_have_exif,
+    _read_exif_date_time,
+    _to_strptime_format,
+)
 
 
 @pytest.fixture
@@ -29,3 +46,218 @@ def test_regex_extractor(weevil_img):
     assert date.year == 2021
     assert date.month == 6
     assert date.day == 13
+
+
+def test_regex_extractor_from_strings(weevil_img):
+    extractor = RegexExtractor.from_strings(r"(\d{8}_\d{6})", "YYYYMMDD_HHmmss")
+    assert extractor.extract(weevil_img) == datetime.date(2021, 6, 13)
+    assert extractor is RegexExtractor.from_strings(r"(\d{8}_\d{6})", "YYYYMMDD_HHmmss")
+
+
+def test_regex_extractor_prefix(weevil_img):
+    pattern = re.compile(r"(?:IMG_)?(\d{8}_\d{6})")
+    extractor = RegexExtractor(pattern, "YYYYMMDD_HHmmss", prefix="IMG_")
+    assert extractor.extract(Path("IMG_20210613_164236.jpg")) == datetime.date(
+        2021, 6, 13
+    )
+    assert extractor.extract(weevil_img) is None
+
+
+def test_exif_extractor_header(jpeg_img):
+    with jpeg_img.open("rb") as handle:
+        header = handle.read(64 * 1024)
+    date = ExifImageExtractor().extract(jpeg_img, header=header)
+    assert date == datetime.date(2018, 8, 17)
+
+
+def test_exif_extractor_truncated_header(jpeg_img):
+    with jpeg_img.open("rb") as handle:
+        header = handle.read(1024)
+    date = ExifImageExtractor().extract(jpeg_img, header=header)
+    assert date == datetime.date(2018, 8, 17)
+
+
+@pytest.mark.parametrize(
+    ["name", "expected"],
+    [
+        ("20210613_164236.jpg", datetime.date(2021, 6, 13)),
+        ("Screenshot_20200101-120101_Maps.jpg", datetime.date(2020, 1, 1)),
+        ("gibraltar.jpg", None),
+    ],
+)
+def test_multi_regex_extractor(name, expected):
+    extractor = MultiRegexExtractor(
+        re.compile(r"(?P<a>\d{8}_\d{6})|Screenshot_(?P<b>\d{8}-\d{6})_\w.+"),
+        {"a": "YYYYMMDD_HHmmss", "b": "YYYYMMDD-HHmmss"},
+    )
+    assert extractor.extract(Path(name)) == expected
+
+
+@pytest.mark.parametrize(
+    ["date_fmt", "expected"],
+    [
+        ("YYYYMMDD_HHmmss", "%Y%m%d_%H%M%S"),
+        ("YYYY-MM-DD", "%Y-%m-%d"),
+        ("Do MMMM YYYY", None),
+        ("MMMM YYYY", None),
+        ("DDDD", None),
+    ],
+)
+def test_to_strptime_format(date_fmt, expected):
+    assert _to_strptime_format(date_fmt) == expected
+
+
+def test_regex_extractor_month_name():
+    extractor = RegexExtractor(re.compile(r"(\w+ \d{4})"), "MMMM YYYY")
+    assert extractor.extract(Path("June 2021.jpg")) == datetime.date(2021, 6, 1)
+
+
+def test_regex_extractor_pendulum_format():
+    extractor = RegexExtractor(re.compile(r"(\d+ \w+ \d{4})"), "D MMMM YYYY")
+    assert extractor.extract(Path("13 June 2021.jpg")) == datetime.date(2021, 6, 13)
+
+
+def test_multi_regex_extractor_missing_format():
+    with pytest.raises(ValueError):
+        MultiRegexExtractor(
+            re.compile(r"(?P<a>\d{8})|IMG-(?P<b>\d{8})"), {"a": "YYYYMMDD"}
+        )
+
+
+@pytest.mark.skipif(shutil.which("exiftool") is None, reason="requires exiftool")
+def test_exiftool_batch(jpeg_img):
+    missing = Path("does_not_exist.mp4")
+    with ExifToolBatch() as batch:
+        dates = batch.get_dates([jpeg_img, missing])
+    assert dates[jpeg_img] == datetime.date(2018, 8, 17)
+    assert missing not in dates
+
+
+class FakeExifTool:
+    """Stand-in for a `-stay_open` exiftool process, reporting the same CreateDate
+    for every file it is given."""
+
+    def __init__(self, args, **kwargs):
+        self.stdin = self
+        self.stdout = iter([])
+        self._buffer = b""
+
+    def write(self, data: bytes) -> None:
+        self._buffer += data
+
+    def flush(self) -> None:
+        args = self._buffer.splitlines()
+        self._buffer = b""
+        if args[-1:] != [b"-execute"]:
+            return
+        records = [
+            {"SourceFile": os.fsdecode(arg), "CreateDate": "2020:01:02 10:00:00"}
+            for arg in args[2:-1]
+        ]
+        output = os.fsencode(json.dumps(records, ensure_ascii=False))
+        self.stdout = iter([output + b"\n", b"{ready}\n"])
+
+    def poll(self):
+        return None
+
+    def wait(self):
+        return 0
+
+
+def test_exiftool_batch_undecodable_name(monkeypatch):
+    monkeypatch.setattr(subprocess, "Popen", FakeExifTool)
+    paths = [Path("a.mp4"), Path(os.fsdecode(b"b\xff.mp4"))]
+    with ExifToolBatch() as batch:
+        dates = batch.get_dates(paths)
+    assert dates == {path: datetime.date(2020, 1, 2) for path in paths}
+
+
+def test_exiftool_extractor_prefetch_failure(monkeypatch):
+    class BrokenExifTool(FakeExifTool):
+        def flush(self):
+            self.stdout = iter([b"not json\n", b"{ready}\n"])
+
+    def run(args, **kwargs):
+        return subprocess.CompletedProcess(args, 0, stdout=b"2020:01:03 10:00:00\n")
+
+    monkeypatch.setattr(subprocess, "Popen", BrokenExifTool)
+    monkeypatch.setattr(subprocess, "run", run)
+    extractor = ExifToolExtractor()
+    extractor.prefetch([Path("a.mp4")])
+    assert extractor.extract(Path("a.mp4")) == datetime.date(2020, 1, 3)
+    extractor.close()
+
+
+@pytest.mark.parametrize(
+    ["value", "expected"],
+    [
+        ("2018:08:17 16:55:06", datetime.date(2018, 8, 17)),
+        ("2018:08:17", datetime.date(2018, 8, 17)),
+    ],
+)
+def test_date_from_exif(value, expected):
+    assert _date_from_exif(value) == expected
+
+
+@pytest.mark.parametrize("value", ["    :  :     :  :  ", "2018:02:30 00:00:00"])
+def test_date_from_exif_invalid(value):
+    with pytest.raises(ValueError):
+        _date_from_exif(value)
+
+
+@pytest.mark.parametrize("endian", ["<", ">"])
+def test_read_exif_date_time(endian):
+    exif = Image.Exif()
+    exif.endian = endian
+    exif[0x010F] = "Camera"  # Make
+    exif[0x0132] = "2020:01:01 12:01:01"  # DateTime
+    assert _read_exif_date_time(exif.tobytes()) == "2020:01:01 12:01:01"
+
+
+@pytest.mark.parametrize(
+    "exif", [b"", b"Exif\0\0II*\0\x08\0\0\0\x05", Image.Exif().tobytes()]
+)
+def test_read_exif_date_time_missing(exif):
+    assert _read_exif_date_time(exif) is None
+
+
+def test_find_jpeg_exif(jpeg_img):
+    exif = _find_jpeg_exif(jpeg_img.read_bytes())
+    assert exif is not None
+    assert _read_exif_date_time(exif) == "2018:08:17 16:55:06"
+
+
+def test_find_jpeg_exif_without_exif(tmp_path):
+    path = tmp_path / Path("plain.jpg")
+    Image.new("RGB", (4, 4)).save(path)
+    assert _find_jpeg_exif(path.read_bytes()) == b""
+
+
+@pytest.mark.parametrize(
+    "data", [b"", b"\x89PNG\r\n\x1a\n", b"\xff\xd8\xff\xe1\x10\0Exif"]
+)
+def test_find_jpeg_exif_undetermined(data):
+    assert _find_jpeg_exif(data) is None
+
+
+def test_exif_extractor_png(tmp_path):
+    exif = Image.Exif()
+    exif[0x0132] = "2020:01:01 12:01:01"  # DateTime
+    path = tmp_path / Path("exif.png")
+    Image.new("RGB", (4, 4)).save(path, exif=exif.tobytes())
+    assert ExifImageExtractor().extract(path) == datetime.date(2020, 1, 1)
+
+
+def test_exif_extractor_tiff(tmp_path):
+    path = tmp_path / Path("exif.tiff")
+    Image.new("RGB", (4, 4)).save(path, tiffinfo={0x0132: "2020:01:01 12:01:01"})
+    assert ExifImageExtractor().extract(path) == datetime.date(2020, 1, 1)
+
+
+@pytest.mark.parametrize("image_format", ["PNG", "GIF", "BMP"])
+def test_exif_extractor_without_exif(tmp_path, image_format):
+    path = tmp_path / Path("plain")
+    Image.new("RGB", (4, 4)).save(path, format=image_format)
+    header = path.read_bytes()
+    assert not _may_have_exif(header)
+    assert ExifImageExtractor().extract(path) is None
@@ -5,12 +5,27 @@ test_organize.py
 :copyright: (c) 2019 Sander Bollen
 :license: BSD-3-clause
 """
-from datetime import datetime
+import shutil
+from datetime import date, datetime
 from pathlib import Path
+from typing import List
 
 import pytest
 
-from image_date_organizer.organize import create_date_path, is_image
+from image_date_organizer import organize
+from image_date_organizer.extractors import Extractor
+from image_date_organizer.organize import (
+    DEFAULT_IMAGE_EXTRACTORS,
+    DEFAULT_VIDEO_EXTRACTORS,
+    Organizer,
+    _iter_files,
+    create_date_path,
+    is_image,
+    is_mp4,
+    link_file,
+    verify_copy,
+)
+from image_date_organizer.utils import MetadataCache
 
 
 @pytest.fixture
@@ -18,6 +33,21 @@ def jpeg_img(data_dir):
     return data_dir / Path("gibraltar.jpg")
 
 
+@pytest.fixture
+def source_dir(data_dir, tmp_path) -> Path:
+    source = tmp_path / Path("source")
+    shutil.copytree(data_dir, source / Path("nested"))
+    return source
+
+
+@pytest.fixture
+def organizer() -> Organizer:
+    return Organizer(
+        image_extractors=DEFAULT_IMAGE_EXTRACTORS,
+        video_extractors=DEFAULT_VIDEO_EXTRACTORS,
+    )
+
+
 def test_create_date_path(data_dir):
     now = datetime.utcnow()
     now_part = Path(str(now.year)) / Path(str(now.month)) / Path(str(now.day))
@@ -25,9 +55,190 @@ def test_create_date_path(data_dir):
     assert create_date_path(data_dir, now) == expected
 
 
+@pytest.mark.parametrize(
+    ["name", "expected"],
+    [
+        ("20200101_120101.jpg", date(2020, 1, 1)),
+        ("Screenshot_20200101-120101_Maps.jpg", date(2020, 1, 1)),
+        ("IMG-20200101-WA0001.jpg", date(2020, 1, 1)),
+        ("Copy of 20200101_120101.jpg", None),
+    ],
+)
+def test_default_image_name_patterns(name, expected):
+    extractor = DEFAULT_IMAGE_EXTRACTORS[1]
+    assert extractor.extract(Path(name)) == expected
+
+
 def test_jpeg_is_image(jpeg_img):
     assert is_image(jpeg_img)
 
 
 def test_rand_file_is_not_image(rand_file):
     assert not is_image(rand_file)
+
+
+def test_image_suffix_is_image(rand_file, tmp_path):
+    path = tmp_path / Path("random.JPG")
+    shutil.copy(rand_file, path)
+    assert is_image(path)
+
+
+def test_video_suffix_is_mp4(rand_file, tmp_path):
+    path = tmp_path / Path("random.mp4")
+    shutil.copy(rand_file, path)
+    assert is_mp4(path)
+    assert not is_image(path)
+
+
+@pytest.mark.parametrize("verify", [True, False])
+def test_verify_copy(rand_file, tmp_path, verify):
+    dest = tmp_path / Path("random.txt")
+    verify_copy(rand_file, dest, verify=verify)
+    assert dest.read_bytes() == rand_file.read_bytes()
+    assert dest.stat().st_mtime == rand_file.stat().st_mtime
+
+
+@pytest.mark.parametrize("verify", [True, False])
+def test_verify_copy_existing(rand_file, tmp_path, verify):
+    dest = tmp_path / Path("random.txt")
+    dest.write_bytes(b"existing")
+    with pytest.raises(FileExistsError):
+        verify_copy(rand_file, dest, verify=verify)
+    assert dest.read_bytes() == b"existing"
+
+
+def test_iter_files(source_dir):
+    directories = []
+    names = sorted(entry.name for entry in _iter_files(source_dir, directories))
+    assert names == ["20210613_164236.jpg", "gibraltar.jpg", "random.txt"]
+    assert directories[0] == source_dir
+    assert source_dir / Path("nested") in directories
+
+
+def test_organize_dir(organizer, source_dir, tmp_path):
+    dest = tmp_path / Path("dest")
+    organizer.organize(source_dir, dest)
+    assert (dest / Path("2018/8/17/gibraltar.jpg")).is_file()
+    assert (dest / Path("2021/6/13/20210613_164236.jpg")).is_file()
+    assert (source_dir / Path("nested/gibraltar.jpg")).is_file()
+
+
+def test_organize_dir_sequential(source_dir, tmp_path):
+    dest = tmp_path / Path("dest")
+    organizer = Organizer(
+        image_extractors=DEFAULT_IMAGE_EXTRACTORS,
+        video_extractors=DEFAULT_VIDEO_EXTRACTORS,
+        parallel=False,
+    )
+    organizer.organize(source_dir, dest)
+    assert (dest / Path("2018/8/17/gibraltar.jpg")).is_file()
+    assert (dest / Path("2021/6/13/20210613_164236.jpg")).is_file()
+
+
+def test_organize_dir_remove_source(source_dir, tmp_path):
+    dest = tmp_path / Path("dest")
+    organizer = Organizer(
+        image_extractors=DEFAULT_IMAGE_EXTRACTORS,
+        video_extractors=DEFAULT_VIDEO_EXTRACTORS,
+        remove_source=True,
+    )
+    organizer.organize(source_dir, dest)
+    assert (dest / Path("2018/8/17/gibraltar.jpg")).is_file()
+    # random.txt is not an image, so nested directories can't be removed.
+    assert not (source_dir / Path("nested/gibraltar.jpg")).exists()
+    assert (source_dir / Path("nested/random.txt")).is_file()
+
+
+def test_link_file(rand_file, tmp_path):
+    source = tmp_path / Path("source.txt")
+    shutil.copy(rand_file, source)
+    dest = tmp_path / Path("random.txt")
+    assert link_file(source, dest)
+    assert dest.stat().st_ino == source.stat().st_ino
+    with pytest.raises(FileExistsError):
+        link_file(source, dest)
+
+
+def test_organize_dir_hardlink(source_dir, tmp_path):
+    dest = tmp_path / Path("dest")
+    organizer = Organizer(
+        image_extractors=DEFAULT_IMAGE_EXTRACTORS,
+        video_extractors=DEFAULT_VIDEO_EXTRACTORS,
+        hardlink=True,
+    )
+    organizer.organize(source_dir, dest)
+    source = source_dir / Path("nested/gibraltar.jpg")
+    assert (
+        dest / Path("2018/8/17/gibraltar.jpg")
+    ).stat().st_ino == source.stat().st_ino
+
+
+class RecordingExtractor(Extractor):
+    """Extracts a fixed date, recording the paths it was asked to prefetch."""
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.prefetched: List[Path] = []
+
+    def extract(self, path, header=None, stat=None):
+        return date(2020, 1, 1)
+
+    def prefetch(self, paths):
+        self.prefetched.extend(paths)
+
+
+def test_organize_dir_skips_prefetch_of_cached(source_dir, tmp_path):
+    extractor = RecordingExtractor()
+    with MetadataCache(tmp_path / Path("cache.db")) as cache:
+        organizer = Organizer(image_extractors=[extractor], cache=cache)
+        organizer.organize(source_dir, tmp_path / Path("dest"))
+        assert len(extractor.prefetched) == 2
+        extractor.prefetched.clear()
+        organizer.organize(source_dir, tmp_path / Path("dest2"))
+    assert extractor.prefetched == []
+    assert (tmp_path / Path("dest2/2020/1/1/gibraltar.jpg")).is_file()
+
+
+class PathOnlyExtractor(Extractor):
+    def extract(self, path):
+        return date(2020, 1, 1)
+
+
+def test_organize_dir_path_only_extractor(source_dir, tmp_path):
+    dest = tmp_path / Path("dest")
+    Organizer(image_extractors=[PathOnlyExtractor()]).organize(source_dir, dest)
+    assert (dest / Path("2020/1/1/gibraltar.jpg")).is_file()
+
+
+def test_organize_dir_sniffs_once(organizer, source_dir, tmp_path, monkeypatch):
+    calls = []
+    mimetype = organize._mimetype
+
+    def counting_mimetype(path, header=None):
+        calls.append(path)
+        return mimetype(path, header)
+
+    monkeypatch.setattr(organize, "_mimetype", counting_mimetype)
+    organizer.organize(source_dir, tmp_path / Path("dest"))
+    # Only random.txt lacks a known extension.
+    assert calls == [source_dir / Path("nested/random.txt")]
+
+
+def test_organize_dir_remove_source_verifies(source_dir, tmp_path, monkeypatch):
+    verified = []
+
+    def recording_verify_copy(source, destination, verify=True):
+        verified.append(verify)
+        verify_copy(source, destination, verify=verify)
+
+    monkeypatch.setattr(organize, "link_file", lambda source, destination: False)
+    monkeypatch.setattr(organize, "verify_copy", recording_verify_copy)
+    organizer = Organizer(
+        image_extractors=DEFAULT_IMAGE_EXTRACTORS,
+        video_extractors=DEFAULT_VIDEO_EXTRACTORS,
+        remove_source=True,
+        verify=False,
+    )
+    organizer.organize(source_dir, tmp_path / Path("dest"))
+    assert verified == [True, True]
+    assert not (source_dir / Path("nested/gibraltar.jpg")).exists()
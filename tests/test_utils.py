@@ -5,11 +5,20 @@ test_utils.py
 :copyright: (c) 2019 Sander Bollen
 :license: BSD-3-clause
 """
+import datetime
+import hashlib
+import os
 from pathlib import Path
 
 import pytest
 
-from image_date_organizer.utils import sha256_file
+from image_date_organizer.utils import (
+    MMAP_THRESHOLD,
+    MetadataCache,
+    copy_and_hash,
+    copy_fileobj,
+    sha256_file,
+)
 
 
 def test_sha256_file(rand_file):
@@ -18,6 +27,21 @@ def test_sha256_file(rand_file):
     )
 
 
+def test_sha256_empty_file(tmp_path):
+    path = tmp_path / Path("empty")
+    path.touch()
+    assert sha256_file(path) == (
+        "e3b0c44298fc1c149afbf4c8996fb92427ae41e4649b934ca495991b7852b855"
+    )
+
+
+def test_sha256_large_file(tmp_path):
+    path = tmp_path / Path("large")
+    data = os.urandom(MMAP_THRESHOLD + 1)
+    path.write_bytes(data)
+    assert sha256_file(path) == hashlib.sha256(data).hexdigest()
+
+
 def test_sha256_file_not_found():
     with pytest.raises(FileNotFoundError):
         sha256_file(Path("does_not_exists__by_a_long_shot"))
@@ -26,3 +50,36 @@ def test_sha256_file_not_found():
 def test_sha256_file_invalid_chunksize(rand_file):
     with pytest.raises(ValueError):
         sha256_file(rand_file, -1)
+
+
+def test_copy_and_hash(rand_file, tmp_path):
+    dest = tmp_path / Path("random.txt")
+    assert copy_and_hash(rand_file, dest, 1000) == sha256_file(rand_file)
+    assert dest.read_bytes() == rand_file.read_bytes()
+
+
+def test_copy_fileobj(rand_file, tmp_path):
+    dest = tmp_path / Path("random.txt")
+    with rand_file.open("rb") as src_handle, dest.open("xb") as dest_handle:
+        copy_fileobj(src_handle, dest_handle)
+    assert dest.read_bytes() == rand_file.read_bytes()
+
+
+def test_metadata_cache(rand_file, tmp_path):
+    db = tmp_path / Path("cache.db")
+    date = datetime.date(2021, 6, 13)
+    stat = rand_file.stat()
+    with MetadataCache(db) as cache:
+        assert cache.get_date(rand_file, stat) is None
+        cache.set_date(rand_file, stat, date)
+    with MetadataCache(db) as cache:
+        assert cache.get_date(rand_file, stat) == date
+
+
+def test_metadata_cache_changed_file(rand_file, tmp_path):
+    path = tmp_path / Path("random.txt")
+    path.write_bytes(rand_file.read_bytes())
+    with MetadataCache(tmp_path / Path("cache.db")) as cache:
+        cache.set_date(path, path.stat(), datetime.date(2021, 6, 13))
+        os.utime(path, (0, 0))
+        assert cache.get_date(path, path.stat()) is None